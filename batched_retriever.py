@@ -0,0 +1,170 @@
+# batched_retriever.py
+import asyncio
+import concurrent.futures
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+logger = logging.getLogger(__name__)
+
+class QueryBatcher:
+    """
+    Coalesces retrieval queries that arrive within a short window into one batch.
+
+    Each batch is embedded with a single ``embed_documents`` call and searched with
+    a single call to ``search`` (e.g. ``chroma_batch_search`` or ``faiss_batch_search``)
+    over all embeddings, amortizing the per-call overhead of both backends across
+    concurrent requests.
+    Since ``embed_documents`` defaults to the "retrieval_document" task type, pass an
+    embeddings instance built with ``task_type="retrieval_query"`` so that queries are
+    embedded the same way ``embed_query`` would embed them.
+    Batches run on the batcher's own worker thread rather than the loop's default
+    executor, which may be fully occupied by chains blocked waiting on this batcher.
+    Queries whose embedding the caller already has (see ``remember``) are not embedded again.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        search: Callable[[List[List[float]], int], List[List[Document]]],
+        k: int = 5,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 20.0,
+        max_known_vectors: int = 256
+    ):
+        self.embedding = embedding
+        self.search = search
+        self.k = k
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_known_vectors = max_known_vectors
+        self._known_vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._queue: "asyncio.Queue[Tuple[str, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        """Starts the background batching task on the running event loop."""
+        if self._task is None:
+            # Batches are processed one at a time, so a single worker thread suffices
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-batcher")
+            self._task = asyncio.create_task(self._run())
+            logger.info("Query batcher started (max batch %s, window %.0f ms).", self.max_batch_size, self.max_wait * 1000)
+
+    async def stop(self) -> None:
+        """Cancels the background task and fails any queries still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Query batcher stopped."))
+
+    def remember(self, query: str, vector: List[float]) -> None:
+        """
+        Records the embedding of a query that is about to be retrieved, so that its batch
+        can reuse it instead of embedding the query again. Call from the event loop.
+
+        The vector must come from the same embedding model and task type as the batcher's.
+        """
+        self._known_vectors[query] = vector
+        self._known_vectors.move_to_end(query)
+        while len(self._known_vectors) > self.max_known_vectors:
+            self._known_vectors.popitem(last=False)
+
+    async def submit(self, query: str) -> List[Document]:
+        """
+        Queues a query for the next batch and waits for its documents.
+
+        Args:
+            query (str): The retrieval query.
+
+        Returns:
+            List[Document]: The top ``k`` documents for the query.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """Waits for one query, then gathers more until the batch is full or the window closes."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _search(self, queries: List[str], vectors: List[Optional[List[float]]]) -> List[List[Document]]:
+        """Embeds the queries without a known vector and searches the whole batch, one call each."""
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self.embedding.embed_documents([queries[i] for i in missing])):
+                vectors[i] = vector
+        return self.search(vectors, self.k)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            queries = [query for query, _ in batch]
+            vectors = [self._known_vectors.pop(query, None) for query in queries]
+            try:
+                documents = await loop.run_in_executor(self._executor, self._search, queries, vectors)
+            except Exception as e:
+                logger.error("Error retrieving batch of %s queries: %s", len(queries), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            logger.info("Retrieved documents for a batch of %s queries.", len(queries))
+            for (_, future), docs in zip(batch, documents):
+                if not future.done():
+                    future.set_result(docs)
+
+class BatchedRetriever(BaseRetriever):
+    """
+    Retriever that routes every query through a shared QueryBatcher.
+
+    Synchronous callers (e.g. a chain running in a worker thread) hand their query
+    to the batcher's event loop and block until the batch containing it completes,
+    for at most ``timeout`` seconds.
+    """
+
+    batcher: Any
+    loop: Any
+    timeout: float = 30.0
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        future = asyncio.run_coroutine_threadsafe(self.batcher.submit(query), self.loop)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return await asyncio.wait_for(self.batcher.submit(query), self.timeout)
@@ -3,6 +3,11 @@
 echo "Installing Python dependencies..."
 pip install -r requirements.txt
 
+# Compile the hot text-cleaning and keyword-matching helpers to a C extension.
+# Python imports utils.*.so ahead of utils.py; if compilation fails the pure-Python module is used.
+echo "Compiling utils.py with mypyc..."
+pip install "mypy==1.10.0" && mypyc utils.py || echo "mypyc compilation failed; using pure-Python utils.py."
+
 echo "Attempting to download ChromaDB from Hugging Face..."
 mkdir -p db # Ensure the 'db' directory exists
 
@@ -1,21 +1,90 @@
 # fastapi_app.py
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import httpx
+import json
 import logging
 import os # Import os for environment variables
+
+# Configure logging before importing the app modules: config.py calls basicConfig on
+# import, and only the first call takes effect. LOG_LEVEL=WARNING skips per-request info logs.
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 from config import GROQ_API_KEY # Assuming GEMINI_API_KEY will be from os.getenv
 from llms import init_gemini_llm, init_embeddings
-from vector_db import load_chroma_db
-# Import get_session_history from qa_chain, not store
-from qa_chain import create_conversational_chain, get_session_history, merge_groq_and_rag_answers, GoogleSheetChatMessageHistory # Import GoogleSheetChatMessageHistory
+from vector_db import load_chroma_db, chroma_batch_search
+from qa_chain import create_conversational_chain, merge_groq_and_rag_answers, merge_fallback_answer, stream_merged_answer
 from groq_api import cached_groq_answers
-from utils import extract_spiritual_concept, extract_life_problem, extract_scripture_source, clean_response_text, clean_suggestions, contains_table_request
-import uuid
+from semantic_cache import SemanticCache
+from batched_retriever import QueryBatcher, BatchedRetriever
+from history_store import HistoryStore
+from utils import extract_features, clean_response_text, clean_suggestions, IncrementalCleaner
+import secrets
 import re # Keep for clean_response_text if it was used directly, but now imported
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+
+# Retrieve API keys and Google Sheet credentials from environment variables
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON")
+# "chroma" (default) or "faiss" for the int8-quantized HNSW index built by migrate_to_faiss.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+
+if not GEMINI_API_KEY:
+    logger.error("GEMINI_API_KEY environment variable not set.")
+if not GROQ_API_KEY: # This is still from config.py based on original, can move to env as well
+    logger.warning("GROQ_API_KEY environment variable not set. Groq suggestions will be skipped.")
+if not GOOGLE_CREDENTIALS_JSON:
+    logger.error("GOOGLE_CREDENTIALS_JSON environment variable not set. Chat history will not be saved.")
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the LLM, embeddings, vector store and chain once at startup."""
+    logger.info("Initializing models, vector store and conversational chain.")
+    app.state.llm = init_gemini_llm(GEMINI_API_KEY)
+    app.state.embedding = init_embeddings(GEMINI_API_KEY) # Pass API key to init_embeddings
+    if VECTOR_BACKEND == "faiss":
+        # Imported lazily so faiss is only required when this backend is selected
+        from vector_db_faiss import load_faiss_db, faiss_batch_search
+        app.state.db = load_faiss_db(app.state.embedding)
+        search = lambda vectors, k: faiss_batch_search(app.state.db, vectors, k)
+    else:
+        app.state.db = load_chroma_db(app.state.embedding)
+        search = lambda vectors, k: chroma_batch_search(app.state.db, vectors, k)
+    # Coalesce concurrent retrievals into batched embedding and vector store calls. The batcher
+    # embeds queries with embed_documents, so it gets an instance fixed to the query task type.
+    app.state.query_embedding = init_embeddings(GEMINI_API_KEY, task_type="retrieval_query")
+    app.state.batcher = QueryBatcher(app.state.query_embedding, search, k=5)
+    app.state.batcher.start()
+    app.state.retriever = BatchedRetriever(batcher=app.state.batcher, loop=asyncio.get_running_loop())
+    # Serve session histories from memory and write them behind to Google Sheets
+    app.state.history_store = HistoryStore(GOOGLE_CREDENTIALS_JSON, asyncio.get_running_loop())
+    # Create conversational chain, passing Google Sheet credentials
+    app.state.chain = create_conversational_chain(
+        app.state.llm,
+        app.state.retriever,
+        GOOGLE_CREDENTIALS_JSON,
+        history_factory=app.state.history_store.get
+    )
+    # Semantic cache for answers to near-identical queries
+    app.state.semantic_cache = SemanticCache()
+    # One HTTP client for all Groq calls, so connections and TLS sessions are reused
+    app.state.http_client = httpx.AsyncClient()
+    logger.info("Startup initialization complete.")
+    yield
+    await app.state.batcher.stop()
+    await app.state.history_store.flush_all()
+    await app.state.http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for Flutter app
 app.add_middleware(
@@ -23,79 +92,200 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"], # Lets browser clients read it to send If-None-Match
 )
 
+# Reply for queries that are only a greeting, matching the merge prompts' greeting guidance
+CANNED_GREETING = "Namaste! How can I assist you with Hindu scriptures today?"
+EMPTY_SUGGESTIONS = {"llama": "N/A", "mixtral": "N/A", "gemma": "N/A"}
+
 class ChatRequest(BaseModel):
     query: str
     session_id: str = None
     format_table: bool = False
+    stream: bool = False # Stream the answer as server-sent events instead of one JSON body
 
-# Retrieve API keys and Google Sheet credentials from environment variables
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON")
+def _record_turn(history_store: HistoryStore, session_id: str, query: str, answer: str) -> None:
+    """Appends a user query and the answer served for it to the session history."""
+    history = history_store.get(session_id)
+    history.add_user_message(query)
+    history.add_ai_message(answer)
 
-if not GEMINI_API_KEY:
-    logging.error("GEMINI_API_KEY environment variable not set.")
-if not GROQ_API_KEY: # This is still from config.py based on original, can move to env as well
-    logging.warning("GROQ_API_KEY environment variable not set. Groq suggestions will be skipped.")
-if not GOOGLE_CREDENTIALS_JSON:
-    logging.error("GOOGLE_CREDENTIALS_JSON environment variable not set. Chat history will not be saved.")
+def _has_history(history_store: HistoryStore, session_id: str) -> bool:
+    """Returns whether the session already has messages that the chain would condition on."""
+    return bool(history_store.get(session_id).messages)
+
+def _last_ai_message(history_store: HistoryStore, session_id: str):
+    """Returns the content of the latest assistant message in the session, if any."""
+    for message in reversed(history_store.get(session_id).messages):
+        if message.type == "ai":
+            return message.content
+    return None
+
+def _sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+def _chat_response(answer: str, suggestions: dict, session_id: str, stream: bool):
+    """Returns a finished answer as JSON, or as a single-delta event stream if requested."""
+    result = {"answer": answer, "suggestions": suggestions, "session_id": session_id}
+    if not stream:
+        return result
 
+    async def events():
+        yield _sse_event({"delta": answer})
+        yield _sse_event({"done": True, **result})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @app.post("/chat")
-async def handle_chat(request: ChatRequest):
-    session_id = request.session_id or f"session_{uuid.uuid4().hex}"
+async def handle_chat(request: ChatRequest, http_request: Request):
+    session_id = request.session_id or f"session_{secrets.token_hex(16)}"
     effective_query = request.query
     
-    format_as_table = contains_table_request(effective_query)
-    logging.info(f"Session {session_id}: Query '{effective_query}' received. Table format requested: {format_as_table}")
+    # Lowercase and scan the query once for every intent and metadata feature
+    features = extract_features(effective_query)
+    format_as_table = features.format_as_table
+    logger.info("Session %s: Query '%s' received. Table format requested: %s", session_id, effective_query, format_as_table)
 
     try:
-        # Initialize components
-        llm = init_gemini_llm(GEMINI_API_KEY)
-        embedding = init_embeddings(GEMINI_API_KEY) # Pass API key to init_embeddings
-        db = load_chroma_db(embedding)
-        retriever = db.as_retriever(search_kwargs={"k": 5})
-        
-        # Create conversational chain, passing Google Sheet credentials
-        conversational_qa_chain = create_conversational_chain(llm, retriever, GOOGLE_CREDENTIALS_JSON)
-        
-        # Extract metadata from query
-        spiritual_concept = extract_spiritual_concept(effective_query)
-        life_problem = extract_life_problem(effective_query)
-        scripture_source = extract_scripture_source(effective_query)
-
-        # Get RAG result
-        logging.info(f"Session {session_id}: Invoking RAG chain for query: '{effective_query}'")
-        rag_result = conversational_qa_chain.invoke({
-            "question": effective_query,
-            "spiritual_concept": spiritual_concept,
-            "life_problem": life_problem,
-            "scripture_source": scripture_source
-        }, config={"configurable": {"session_id": session_id}})
-        
-        raw_rag_answer = rag_result.get("answer", "Could not retrieve from knowledge base.")
-        rag_answer = clean_response_text(raw_rag_answer)
-        logging.info(f"Session {session_id}: RAG raw answer length: {len(raw_rag_answer)}")
-        
-        # Get suggestions from other models
-        suggestions = {"llama": "N/A", "mixtral": "N/A", "gemma": "N/A"}
+        # Reuse components initialized once at startup
+        llm = http_request.app.state.llm
+        conversational_qa_chain = http_request.app.state.chain
+        semantic_cache = http_request.app.state.semantic_cache
+        history_store = http_request.app.state.history_store
+
+        # Pure greetings need no retrieval or model calls
+        if features.is_greeting:
+            logger.info("Session %s: Greeting detected, replying without the RAG pipeline.", session_id)
+            await asyncio.to_thread(_record_turn, history_store, session_id, effective_query, CANNED_GREETING)
+            return _chat_response(CANNED_GREETING, dict(EMPTY_SUGGESTIONS), session_id, request.stream)
+
+        # Metadata extracted from query
+        spiritual_concept = features.spiritual_concept
+        life_problem = features.life_problem
+        scripture_source = features.scripture_source
+
+        # Formatting-only follow-ups (e.g. "show it as a table") reformat the previous answer
+        if features.is_formatting_request:
+            previous_answer = await asyncio.to_thread(_last_ai_message, history_store, session_id)
+            if previous_answer:
+                logger.info("Session %s: Formatting request detected, reformatting previous answer.", session_id)
+                final_answer, _ = await merge_groq_and_rag_answers(
+                    llm,
+                    previous_answer,
+                    EMPTY_SUGGESTIONS,
+                    spiritual_concept,
+                    life_problem,
+                    scripture_source,
+                    format_as_table
+                )
+                final_answer = clean_response_text(final_answer)
+                await asyncio.to_thread(_record_turn, history_store, session_id, effective_query, final_answer)
+                return _chat_response(final_answer, dict(EMPTY_SUGGESTIONS), session_id, request.stream)
+
+        # Serve near-identical queries with the same metadata from the semantic cache. The chain
+        # rephrases follow-ups using the session's history, so only a session's first question
+        # is answered independently of it; later ones neither read nor fill the shared cache.
+        cacheable = not await asyncio.to_thread(_has_history, history_store, session_id)
+        cache_context = (format_as_table, spiritual_concept, life_problem, scripture_source)
+        query_vector = None
+        cached = None
+        if cacheable:
+            # Embedded like the batcher embeds queries, so on a miss retrieval reuses the vector;
+            # a first question has no history, so the chain retrieves with it unchanged
+            query_vector = await asyncio.to_thread(http_request.app.state.query_embedding.embed_query, effective_query)
+            cached = semantic_cache.lookup(query_vector, cache_context)
+            if cached is None:
+                http_request.app.state.batcher.remember(effective_query, query_vector)
+        if cached is not None:
+            logger.info("Session %s: Serving answer from semantic cache.", session_id)
+            # Keep the session history consistent with what the user was shown
+            await asyncio.to_thread(_record_turn, history_store, session_id, effective_query, cached["answer"])
+            return _chat_response(cached["answer"], cached["suggestions"], session_id, request.stream)
+
+        # Get RAG result and Groq suggestions concurrently; the blocking RAG chain runs
+        # in a worker thread while the async Groq requests run on the event loop.
+        logger.info("Session %s: Invoking RAG chain for query: '%s'", session_id, effective_query)
+        rag_task = asyncio.to_thread(
+            conversational_qa_chain.invoke,
+            {
+                "question": effective_query,
+                "spiritual_concept": spiritual_concept,
+                "life_problem": life_problem,
+                "scripture_source": scripture_source
+            },
+            config={"configurable": {"session_id": session_id}}
+        )
         if GROQ_API_KEY:
-            logging.info(f"Session {session_id}: Fetching Groq suggestions.")
-            raw_suggestions = cached_groq_answers(
+            logger.info("Session %s: Fetching Groq suggestions.", session_id)
+            groq_task = cached_groq_answers(
+                http_request.app.state.http_client,
                 effective_query,
                 GROQ_API_KEY,
                 spiritual_concept,
                 life_problem,
                 scripture_source
             )
-            suggestions = clean_suggestions(raw_suggestions)
-            logging.info(f"Session {session_id}: Groq suggestions fetched.")
+            rag_result, (raw_suggestions, suggestions_complete) = await asyncio.gather(rag_task, groq_task)
         else:
-            logging.warning(f"Session {session_id}: GROQ_API_KEY not set. Skipping Groq suggestions.")
+            logger.warning("Session %s: GROQ_API_KEY not set. Skipping Groq suggestions.", session_id)
+            rag_result = await rag_task
+            raw_suggestions, suggestions_complete = None, True
+        # Failed model calls must not be cached and served to other sessions
+        cacheable = cacheable and suggestions_complete
+
+        raw_rag_answer = rag_result.get("answer", "Could not retrieve from knowledge base.")
+        rag_answer = clean_response_text(raw_rag_answer)
+        logger.info("Session %s: RAG raw answer length: %s", session_id, len(raw_rag_answer))
+
+        # Clean suggestions from other models
+        suggestions = dict(EMPTY_SUGGESTIONS)
+        if raw_suggestions is not None:
+            suggestions = clean_suggestions(raw_suggestions)
+            logger.info("Session %s: Groq suggestions fetched.", session_id)
+
+        if request.stream:
+            # Stream the merged answer as it is generated; suggestions follow in the final event
+            async def events():
+                cleaner = IncrementalCleaner()
+                try:
+                    merged = True
+                    try:
+                        async for chunk in stream_merged_answer(
+                            llm,
+                            rag_answer,
+                            suggestions,
+                            spiritual_concept,
+                            life_problem,
+                            scripture_source,
+                            format_as_table
+                        ):
+                            delta = cleaner.feed(chunk)
+                            if delta:
+                                yield _sse_event({"delta": delta})
+                    except Exception as e:
+                        # Already logged; finish the answer with the same fallback as the JSON path
+                        merged = False
+                        delta = cleaner.feed(merge_fallback_answer(e, rag_answer))
+                        if delta:
+                            yield _sse_event({"delta": delta})
+                    delta = cleaner.finish()
+                    if delta:
+                        yield _sse_event({"delta": delta})
+                    final_answer = cleaner.text
+                    await asyncio.to_thread(_record_turn, history_store, session_id, effective_query, final_answer)
+                    if cacheable and merged:
+                        semantic_cache.store(query_vector, {"answer": final_answer, "suggestions": suggestions}, cache_context)
+                    yield _sse_event({"done": True, "answer": final_answer, "suggestions": suggestions, "session_id": session_id})
+                except Exception as e:
+                    # Headers are already sent, so report the failure in-band
+                    logger.error("Streaming error for session %s: %s", session_id, e, exc_info=True)
+                    yield _sse_event({"error": f"Internal server error: {str(e)}", "session_id": session_id})
+
+            return StreamingResponse(events(), media_type="text/event-stream")
 
         # Merge RAG answer and Groq suggestions
-        final_answer = await merge_groq_and_rag_answers(
+        final_answer, merged = await merge_groq_and_rag_answers(
             llm,
             rag_answer,
             suggestions,
@@ -105,15 +295,15 @@ async def handle_chat(request: ChatRequest):
             format_as_table
         )
         final_answer = clean_response_text(final_answer)
-        
-        return {
-            "answer": final_answer,
-            "suggestions": suggestions,
-            "session_id": session_id
-        }
+        # The chain only reads the history; store the merged answer the user sees, not its RAG answer
+        await asyncio.to_thread(_record_turn, history_store, session_id, effective_query, final_answer)
+        if cacheable and merged:
+            semantic_cache.store(query_vector, {"answer": final_answer, "suggestions": suggestions}, cache_context)
+
+        return _chat_response(final_answer, suggestions, session_id, False)
         
     except Exception as e:
-        logging.error(f"API Error for session {session_id}: {str(e)}", exc_info=True)
+        logger.error("API Error for session %s: %s", session_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/health")
@@ -122,51 +312,61 @@ async def health_check():
     return {"status": "healthy", "message": "Hindu Scripture Advisor API is running"}
 
 @app.get("/sessions/{session_id}/history")
-async def get_chat_history_endpoint(session_id: str): # Renamed to avoid conflict with imported function
-    """Get chat history for a session"""
+async def get_chat_history_endpoint(session_id: str, request: Request, response: Response, limit: int = 50, offset: int = 0): # Renamed to avoid conflict with imported function
+    """Get a page of chat history for a session"""
     try:
-        # Instantiate history object with credentials
-        history = GoogleSheetChatMessageHistory(session_id, GOOGLE_CREDENTIALS_JSON)
-        messages = []
-        for message in history.messages:
-            content = clean_response_text(message.content) if hasattr(message, 'content') else str(message)
-            messages.append({
-                "type": message.type,
-                "content": content
-            })
-        logging.info(f"Retrieved {len(messages)} history entries for session {session_id}.")
+        history_store = request.app.state.history_store
+        # Served from memory; only the first touch of a session reads the Google Sheet,
+        # and only messages added since the last read are cleaned
+        version, types, contents = await asyncio.to_thread(history_store.cleaned_view, session_id)
+        offset, limit = max(offset, 0), max(limit, 0)
+
+        # The version changes on every append or clear, so an unchanged tag means an unchanged page
+        etag = f'W/"{history_store.etag_prefix}-{version}-{offset}-{limit}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+
+        page = slice(offset, offset + limit)
+        messages = [{"type": t, "content": c} for t, c in zip(types[page], contents[page])]
+        logger.info("Retrieved %s of %s history entries for session %s.", len(messages), len(types), session_id)
         return {
             "session_id": session_id,
             "messages": messages,
-            "count": len(messages)
+            "count": len(types)
         }
     except Exception as e:
-        logging.error(f"Error retrieving history for session {session_id}: {str(e)}", exc_info=True)
+        logger.error("Error retrieving history for session %s: %s", session_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail="Could not retrieve chat history")
 
 @app.delete("/sessions/{session_id}")
-async def clear_session(session_id: str):
+async def clear_session(session_id: str, request: Request):
     """Clear chat history for a session"""
     try:
-        # Instantiate history object and clear
-        history = GoogleSheetChatMessageHistory(session_id, GOOGLE_CREDENTIALS_JSON)
-        history.clear()
-        logging.info(f"Cleared session {session_id}")
+        # Clear in memory and in the Google Sheet, dropping any unsaved messages
+        await request.app.state.history_store.clear(session_id)
+        logger.info("Cleared session %s", session_id)
         return {"message": f"Session {session_id} cleared successfully"}
     except Exception as e:
-        logging.error(f"Error clearing session {session_id}: {str(e)}", exc_info=True)
+        logger.error("Error clearing session %s: %s", session_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Could not clear session: {str(e)}")
 
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
 if __name__ == "__main__":
     import uvicorn
     # When deploying to Render, the port will be provided by the environment,
     # so listen on 0.0.0.0 and use the PORT environment variable if available.
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # WEB_CONCURRENCY sets the number of worker processes (e.g. the CPU count). Each worker
+    # runs the lifespan startup, so it holds its own LLM, vector store and caches.
+    # Session histories are cached per worker too, so only raise this behind a load
+    # balancer with sticky sessions (or accept that a worker may briefly serve a stale history).
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    uvicorn.run(
+        "fastapi_app:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools"
+    )
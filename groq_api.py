@@ -1,20 +1,25 @@
 # groq_api.py
-import requests
+import asyncio
+import httpx
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
 
-def groq_scripture_answer(
+logger = logging.getLogger(__name__)
+
+async def groq_scripture_answer(
+    client: httpx.AsyncClient,
     model_name: str,
     query: str,
     groq_api_key: str,
     spiritual_concept: str = "general",
     life_problem: str = "guidance",
     scripture_source: str = "Hindu scriptures"
-) -> str:
+) -> Tuple[str, bool]:
     """
     Fetches a concise spiritual guidance answer from a specific Groq model.
 
     Args:
+        client (httpx.AsyncClient): Shared async HTTP client used for the request.
         model_name (str): The name of the Groq model to use (e.g., "llama", "mixtral", "gemma").
         query (str): The user's original query.
         groq_api_key (str): Your Groq API key.
@@ -23,10 +28,11 @@ def groq_scripture_answer(
         scripture_source (str): Extracted scripture source preference from the query.
 
     Returns:
-        str: The concise guidance from the Groq model, or an error message.
+        Tuple[str, bool]: The concise guidance from the Groq model, or an error message,
+            and whether the model actually answered.
     """
     if not groq_api_key:
-        return "Groq API key not available. Skipping suggestions."
+        return "Groq API key not available. Skipping suggestions.", False
     try:
         url = "https://api.groq.com/openai/v1/chat/completions"
         headers = {
@@ -54,32 +60,37 @@ def groq_scripture_answer(
             "temperature": 0.5, # Balanced creativity
             "max_tokens": 250   # Keep responses concise
         }
-        logging.info(f"Calling Groq API: {actual_model_name} for query: '{query}'")
-        response = requests.post(url, headers=headers, json=payload, timeout=15) # Reduced timeout slightly
+        logger.info("Calling Groq API: %s for query: '%s'", actual_model_name, query)
+        response = await client.post(url, headers=headers, json=payload, timeout=15) # Reduced timeout slightly
         response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
         data = response.json()
-        return data['choices'][0]['message']['content'] if 'choices' in data and data['choices'] else f"Empty response from {model_name}."
-    except requests.exceptions.Timeout:
-        logging.warning(f"Timeout error from Groq model {model_name} for query: '{query}'")
-        return f"Timeout error from {model_name}."
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request error from Groq model {model_name} for query '{query}': {e}")
-        return f"Request error from {model_name}: {e}"
+        if 'choices' in data and data['choices']:
+            return data['choices'][0]['message']['content'], True
+        return f"Empty response from {model_name}.", False
+    except httpx.TimeoutException:
+        logger.warning("Timeout error from Groq model %s for query: '%s'", model_name, query)
+        return f"Timeout error from {model_name}.", False
+    except httpx.HTTPError as e:
+        logger.error("Request error from Groq model %s for query '%s': %s", model_name, query, e)
+        return f"Request error from {model_name}: {e}", False
     except Exception as e:
-        logging.error(f"Unexpected error from Groq model {model_name} for query '{query}': {e}")
-        return f"Error from {model_name}: {e}"
+        logger.error("Unexpected error from Groq model %s for query '%s': %s", model_name, query, e)
+        return f"Error from {model_name}: {e}", False
 
-def cached_groq_answers(
+async def cached_groq_answers(
+    client: httpx.AsyncClient,
     query: str,
     groq_api_key: str,
     spiritual_concept: str,
     life_problem: str,
     scripture_source: str
-) -> dict:
+) -> Tuple[Dict[str, str], bool]:
     """
     Fetches and caches Groq answers from multiple models concurrently.
 
     Args:
+        client (httpx.AsyncClient): Shared async HTTP client, reused across requests so
+            connections to the Groq API stay pooled.
         query (str): The user's current query.
         groq_api_key (str): Your Groq API key.
         spiritual_concept (str): Extracted spiritual concept.
@@ -87,27 +98,30 @@ def cached_groq_answers(
         scripture_source (str): Extracted scripture source.
 
     Returns:
-        dict: A dictionary where keys are model names and values are their responses.
+        Tuple[Dict[str, str], bool]: A dictionary where keys are model names and values are
+            their responses, and whether every model answered (no error messages).
     """
-    logging.info(f"Fetching cached Groq answers for query: '{query}'")
+    logger.info("Fetching cached Groq answers for query: '%s'", query)
     models = ["llama", "mixtral", "gemma"]
     results = {}
+    complete = True
 
     if not groq_api_key:
-        logging.warning("Groq API key not provided. Skipping all Groq suggestions.")
-        return {k: "Groq API key not available." for k in models}
+        logger.warning("Groq API key not provided. Skipping all Groq suggestions.")
+        return {k: "Groq API key not available." for k in models}, False
 
-    with ThreadPoolExecutor(max_workers=len(models)) as executor:
-        # Submit tasks to the thread pool, passing the API key
-        future_to_model = {
-            executor.submit(groq_scripture_answer, name, query, groq_api_key, spiritual_concept, life_problem, scripture_source): name
-            for name in models
-        }
-        for future in future_to_model:
-            model_name = future_to_model[future]
-            try:
-                results[model_name] = future.result()
-            except Exception as e:
-                logging.error(f"Error fetching result for Groq model {model_name}: {e}")
-                results[model_name] = f"Failed to get answer: {e}"
-    return results
+    # Fire all model requests at once, passing the API key
+    responses = await asyncio.gather(
+        *(groq_scripture_answer(client, name, query, groq_api_key, spiritual_concept, life_problem, scripture_source)
+          for name in models),
+        return_exceptions=True
+    )
+    for model_name, response in zip(models, responses):
+        if isinstance(response, Exception):
+            logger.error("Error fetching result for Groq model %s: %s", model_name, response)
+            results[model_name] = f"Failed to get answer: {response}"
+            complete = False
+        else:
+            results[model_name], answered = response
+            complete = complete and answered
+    return results, complete
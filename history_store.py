@@ -0,0 +1,208 @@
+# history_store.py
+import asyncio
+import itertools
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from qa_chain import GoogleSheetChatMessageHistory
+from utils import clean_response_text
+
+logger = logging.getLogger(__name__)
+
+class BufferedChatMessageHistory(BaseChatMessageHistory):
+    """Chat message history served from memory and written behind to Google Sheets."""
+
+    def __init__(self, store: "HistoryStore", session_id: str, messages: List[BaseMessage]):
+        self._store = store
+        self.session_id = session_id
+        self._messages = messages
+        # Cleaned column view of the messages, extended lazily by HistoryStore.cleaned_view
+        self._types: List[str] = []
+        self._contents: List[str] = []
+        self._version = 0 # Set by HistoryStore on load, append and clear
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Return the in-memory messages for the session."""
+        return list(self._messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Append a message in memory and schedule it to be written to the sheet."""
+        self._store.append_message(self, message)
+
+    def clear(self) -> None:
+        """Clear the session in memory and schedule the sheet to be cleared."""
+        self._store.schedule_clear(self.session_id)
+
+class HistoryStore:
+    """
+    In-process LRU of session histories with debounced write-behind to Google Sheets.
+
+    A session is loaded from its sheet the first time it is touched; afterwards reads
+    are served from memory and new messages are batched into one sheet write per
+    session, ``flush_delay`` seconds after the first unsaved message.
+    Histories are returned from ``get`` synchronously so that they can be used as the
+    session-history factory of a RunnableWithMessageHistory running in a worker thread.
+    """
+
+    def __init__(
+        self,
+        credentials_json: str,
+        loop: asyncio.AbstractEventLoop,
+        max_sessions: int = 256,
+        flush_delay: float = 1.0
+    ):
+        self.credentials_json = credentials_json
+        self.loop = loop
+        self.max_sessions = max_sessions
+        self.flush_delay = flush_delay
+        self._sessions: "OrderedDict[str, BufferedChatMessageHistory]" = OrderedDict()
+        self._backends: Dict[str, GoogleSheetChatMessageHistory] = {}
+        self._pending: Dict[str, List[BaseMessage]] = {}
+        self._flush_locks: Dict[str, asyncio.Lock] = {}
+        # Number of flushes or clears queued or running per session; such sessions are not
+        # evicted, since reloading them mid-write would miss the rows being written
+        self._writers: Dict[str, int] = {}
+        # Each load, append or clear gets a new version from a store-wide counter, so a
+        # version never repeats for a session even after it is evicted and reloaded.
+        # The random prefix keeps ETags from different worker processes apart.
+        self._version_counter = itertools.count(1)
+        self.etag_prefix = secrets.token_hex(4)
+        self._lock = threading.Lock() # Guards the maps above across worker threads
+
+    def _backend(self, session_id: str) -> GoogleSheetChatMessageHistory:
+        backend = self._backends.get(session_id)
+        if backend is None:
+            backend = GoogleSheetChatMessageHistory(session_id, self.credentials_json)
+            self._backends[session_id] = backend
+        return backend
+
+    def get(self, session_id: str) -> BufferedChatMessageHistory:
+        """
+        Returns the buffered history for a session, loading it from Sheets on first touch.
+
+        This may block on the Sheets API, so call it from a worker thread.
+        """
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is not None:
+                self._sessions.move_to_end(session_id)
+                return history
+        # Load outside the lock so other sessions are not blocked on the Sheets round-trip
+        messages = self._backend(session_id).messages
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = BufferedChatMessageHistory(self, session_id, messages)
+                self._sessions[session_id] = history
+                history._version = next(self._version_counter)
+                logger.info("Loaded %s history messages for session %s into memory.", len(messages), session_id)
+            self._sessions.move_to_end(session_id)
+            self._evict()
+        return history
+
+    def cleaned_view(self, session_id: str) -> Tuple[int, List[str], List[str]]:
+        """
+        Returns the session's version and its message types and cleaned contents as parallel lists.
+
+        Only messages added since the previous call are cleaned; the returned lists
+        share storage with the cache, so callers must not modify them.
+        """
+        history = self.get(session_id)
+        with self._lock:
+            for message in history._messages[len(history._types):]:
+                history._types.append(message.type)
+                history._contents.append(
+                    clean_response_text(message.content) if hasattr(message, 'content') else str(message)
+                )
+            return history._version, history._types, history._contents
+
+    def _evict(self) -> None:
+        """Drops least recently used sessions that have no unsaved or in-flight messages."""
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if session_id not in self._pending and session_id not in self._writers:
+                del self._sessions[session_id]
+                self._backends.pop(session_id, None)
+                self._flush_locks.pop(session_id, None)
+
+    def append_message(self, history: BufferedChatMessageHistory, message: BaseMessage) -> None:
+        """Appends a message in memory and queues it for the sheet; safe to call from any thread."""
+        session_id = history.session_id
+        with self._lock:
+            history._messages.append(message)
+            history._version = next(self._version_counter)
+            pending = self._pending.setdefault(session_id, [])
+            pending.append(message)
+            first = len(pending) == 1
+        if first:
+            asyncio.run_coroutine_threadsafe(self._flush_later(session_id), self.loop)
+
+    def schedule_clear(self, session_id: str) -> None:
+        """Schedules a session to be cleared; safe to call from any thread."""
+        asyncio.run_coroutine_threadsafe(self.clear(session_id), self.loop)
+
+    @asynccontextmanager
+    async def _writing(self, session_id: str) -> AsyncIterator[None]:
+        """Serializes sheet writes of a session and keeps it from being evicted meanwhile."""
+        with self._lock:
+            self._writers[session_id] = self._writers.get(session_id, 0) + 1
+            flush_lock = self._flush_locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with flush_lock:
+                yield
+        finally:
+            with self._lock:
+                self._writers[session_id] -= 1
+                if not self._writers[session_id]:
+                    del self._writers[session_id]
+                    # Writes such as clear() may touch sessions that are not in memory; drop
+                    # what they created, since _evict only walks the loaded sessions
+                    if session_id not in self._sessions:
+                        self._backends.pop(session_id, None)
+                        self._flush_locks.pop(session_id, None)
+
+    async def _flush_later(self, session_id: str) -> None:
+        await asyncio.sleep(self.flush_delay)
+        await self.flush(session_id)
+
+    async def flush(self, session_id: str) -> None:
+        """Writes all unsaved messages of a session to its sheet in one call."""
+        async with self._writing(session_id):
+            with self._lock:
+                messages = self._pending.pop(session_id, [])
+            if not messages:
+                return
+            try:
+                backend = await asyncio.to_thread(self._backend, session_id)
+                await asyncio.to_thread(backend.add_messages, messages)
+            except Exception as e:
+                logger.error("Error flushing %s messages for session %s: %s", len(messages), session_id, e)
+
+    async def flush_all(self) -> None:
+        """Writes unsaved messages of every session, e.g. on shutdown."""
+        with self._lock:
+            session_ids = list(self._pending)
+        await asyncio.gather(*(self.flush(session_id) for session_id in session_ids))
+
+    async def clear(self, session_id: str) -> None:
+        """Clears a session in memory and in its sheet, discarding unsaved messages."""
+        async with self._writing(session_id):
+            with self._lock:
+                self._pending.pop(session_id, None)
+                history = self._sessions.get(session_id)
+                if history is not None:
+                    history._messages.clear()
+                    history._types.clear()
+                    history._contents.clear()
+                    history._version = next(self._version_counter)
+            backend = await asyncio.to_thread(self._backend, session_id)
+            await asyncio.to_thread(backend.clear)
@@ -3,6 +3,7 @@ from langchain_google_genai import GoogleGenerativeAI
 from langchain_google_genai import GoogleGenerativeAIEmbeddings # Import for Gemini Embeddings
 import google.generativeai as genai
 import logging
+from typing import Optional
 
 def init_gemini_llm(api_key: str):
     """
@@ -25,12 +26,14 @@ def init_gemini_llm(api_key: str):
         logging.error(f"Error initializing Gemini LLM: {e}")
         raise
 
-def init_embeddings(api_key: str): # Modified to accept API key
+def init_embeddings(api_key: str, task_type: Optional[str] = None): # Modified to accept API key
     """
     Initializes and returns Google Gemini embeddings for text.
 
     Args:
         api_key (str): Your Google Gemini API key.
+        task_type (Optional[str]): Embedding task type applied to every call, e.g.
+            "retrieval_query" for embedding search queries in bulk with embed_documents.
 
     Returns:
         GoogleGenerativeAIEmbeddings: An instance of the Gemini embeddings model.
@@ -39,7 +42,7 @@ def init_embeddings(api_key: str): # Modified to accept API key
         logging.error("Gemini API Key is missing. Cannot initialize Gemini Embeddings.")
         raise ValueError("GEMINI_API_KEY must be provided to initialize Gemini Embeddings.")
     try:
-        return GoogleGenerativeAIEmbeddings(model="embedding-001", google_api_key=api_key)
+        return GoogleGenerativeAIEmbeddings(model="embedding-001", google_api_key=api_key, task_type=task_type)
     except Exception as e:
         logging.error(f"Error initializing Gemini Embeddings: {e}")
         raise
@@ -0,0 +1,41 @@
+# migrate_to_faiss.py
+import os
+import logging
+import google.generativeai as genai # Needed for genai.configure
+from dotenv import load_dotenv # For local environment variables
+from llms import init_embeddings
+from vector_db import load_chroma_db
+from vector_db_faiss import build_faiss_from_chroma
+
+load_dotenv() # Load .env file for local development
+
+# Configure logging for this script
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def main():
+    """
+    One-shot migration of the persisted ChromaDB store into a quantized FAISS
+    HNSW index. Set VECTOR_QUANTIZER to "int8" (default) or "fp16", and
+    VECTOR_BACKEND=faiss to serve from the result.
+    """
+    chroma_dir = "db"
+    output_dir = "faiss_db"
+    quantizer = os.getenv("VECTOR_QUANTIZER", "int8").lower()
+
+    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        logging.critical("GEMINI_API_KEY is not set. Please set it in your environment or .env file.")
+        return
+
+    genai.configure(api_key=gemini_api_key)
+
+    try:
+        embedding = init_embeddings(gemini_api_key)
+        chroma_db = load_chroma_db(embedding, chroma_dir)
+        build_faiss_from_chroma(chroma_db, embedding, output_dir, quantizer=quantizer)
+        logging.info(f"✅ FAISS index successfully created in '{output_dir}'")
+    except Exception as e:
+        logging.critical(f"Failed to migrate ChromaDB to FAISS: {e}")
+
+if __name__ == "__main__":
+    main()
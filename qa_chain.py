@@ -4,7 +4,7 @@ from langchain.chains.llm import LLMChain
 from langchain.chains import ConversationalRetrievalChain
 from langchain.prompts import PromptTemplate
 from langchain_core.chat_history import BaseChatMessageHistory # Correct base class
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.runnables import RunnableConfig, RunnableLambda, RunnablePassthrough
 from langchain_core.language_models import BaseChatModel
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage # For message types
@@ -14,6 +14,9 @@ import gspread # For Google Sheets interaction
 from google.oauth2 import service_account
 import json
 import os
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Define the sheet and credentials globally for the class
 SPREADSHEET_ID = "1MS-6RNx8N0uKnOzunyVNjBFiSUysibCdS8HBk_uyYik" # Your provided spreadsheet ID
@@ -25,7 +28,7 @@ class GoogleSheetChatMessageHistory(BaseChatMessageHistory):
         self.session_id = session_id
         self.client = self._authenticate_gspread(credentials_json)
         self.sheet = self._get_or_create_sheet()
-        logging.info(f"GoogleSheetChatMessageHistory initialized for session: {session_id}")
+        logger.info("GoogleSheetChatMessageHistory initialized for session: %s", session_id)
 
     def _authenticate_gspread(self, credentials_json: str):
         """Authenticates with Google Sheets API using service account credentials."""
@@ -35,7 +38,7 @@ class GoogleSheetChatMessageHistory(BaseChatMessageHistory):
             client = gspread.authorize(creds)
             return client
         except Exception as e:
-            logging.critical(f"Error authenticating with Google Sheets: {e}")
+            logger.critical("Error authenticating with Google Sheets: %s", e)
             raise
 
     def _get_or_create_sheet(self):
@@ -44,21 +47,21 @@ class GoogleSheetChatMessageHistory(BaseChatMessageHistory):
             spreadsheet = self.client.open_by_key(SPREADSHEET_ID)
             try:
                 worksheet = spreadsheet.worksheet(self.session_id)
-                logging.info(f"Found existing worksheet for session: {self.session_id}")
+                logger.info("Found existing worksheet for session: %s", self.session_id)
                 return worksheet
             except gspread.exceptions.WorksheetNotFound:
                 # Create sheet if not found
                 worksheet = spreadsheet.add_worksheet(title=self.session_id, rows=1000, cols=5)
                 # Add headers
                 worksheet.append_row(["Timestamp", "Session ID", "Sender", "Message Content"])
-                logging.info(f"Created new worksheet for session: {self.session_id}")
+                logger.info("Created new worksheet for session: %s", self.session_id)
                 return worksheet
         except gspread.exceptions.SpreadsheetNotFound:
-            logging.critical(f"Spreadsheet with ID '{SPREADSHEET_ID}' not found. "
-                             "Please ensure the ID is correct and the service account has access.")
+            logger.critical("Spreadsheet with ID '%s' not found. "
+                            "Please ensure the ID is correct and the service account has access.", SPREADSHEET_ID)
             raise
         except Exception as e:
-            logging.critical(f"Error accessing or creating worksheet: {e}")
+            logger.critical("Error accessing or creating worksheet: %s", e)
             raise
 
 
@@ -78,7 +81,7 @@ class GoogleSheetChatMessageHistory(BaseChatMessageHistory):
                 elif sender.lower() == "ai":
                     messages.append(AIMessage(content=content))
             else:
-                logging.warning(f"Skipping malformed row in Google Sheet for session {self.session_id}: {row}")
+                logger.warning("Skipping malformed row in Google Sheet for session %s: %s", self.session_id, row)
         return messages
 
     def add_message(self, message: BaseMessage) -> None:
@@ -88,22 +91,35 @@ class GoogleSheetChatMessageHistory(BaseChatMessageHistory):
         content = message.content
         try:
             self.sheet.append_row([timestamp, self.session_id, sender, content])
-            logging.info(f"Message added to Google Sheet for session {self.session_id}: {sender} - {content[:50]}...")
+            logger.info("Message added to Google Sheet for session %s: %s - %s...", self.session_id, sender, content[:50])
+        except Exception as e:
+            logger.error("Error adding message to Google Sheet: %s", e)
+
+    def add_messages(self, messages: list[BaseMessage]) -> None:
+        """Add several messages to the Google Sheet in a single API call."""
+        timestamp = gspread.utils.get_iso_string()
+        rows = [
+            [timestamp, self.session_id, "Human" if isinstance(message, HumanMessage) else "AI", message.content]
+            for message in messages
+        ]
+        try:
+            self.sheet.append_rows(rows)
+            logger.info("%s messages added to Google Sheet for session %s.", len(rows), self.session_id)
         except Exception as e:
-            logging.error(f"Error adding message to Google Sheet: {e}")
+            logger.error("Error adding messages to Google Sheet: %s", e)
 
     def clear(self) -> None:
         """Clear all messages for the current session by deleting the worksheet."""
         try:
             spreadsheet = self.client.open_by_key(SPREADSHEET_ID)
             spreadsheet.del_worksheet(self.sheet)
-            logging.info(f"Cleared session history by deleting worksheet: {self.session_id}")
+            logger.info("Cleared session history by deleting worksheet: %s", self.session_id)
             # Re-initialize the sheet to ensure it's ready for new messages
             self.sheet = self._get_or_create_sheet()
         except gspread.exceptions.WorksheetNotFound:
-            logging.warning(f"Attempted to clear non-existent worksheet for session {self.session_id}.")
+            logger.warning("Attempted to clear non-existent worksheet for session %s.", self.session_id)
         except Exception as e:
-            logging.error(f"Error clearing session in Google Sheet: {e}")
+            logger.error("Error clearing session in Google Sheet: %s", e)
 
 # This will now be a factory function that creates a GoogleSheetChatMessageHistory instance
 def get_session_history(session_id: str, credentials_json: str) -> GoogleSheetChatMessageHistory:
@@ -113,14 +129,14 @@ def get_session_history(session_id: str, credentials_json: str) -> GoogleSheetCh
     """
     # In a real-world scenario, you might want to cache these instances if performance is an issue
     # But for simplicity and to ensure fresh auth, we create one per request.
-    logging.info(f"Requesting session history for session ID: {session_id}")
+    logger.info("Requesting session history for session ID: %s", session_id)
     return GoogleSheetChatMessageHistory(session_id, credentials_json)
 
 def create_qa_chain(llm: BaseChatModel, retriever: VectorStoreRetriever):
     """
     Creates the core QA chain for RAG.
     """
-    logging.info("Creating QA chain using custom prompt and StuffDocumentsChain.")
+    logger.info("Creating QA chain using custom prompt and StuffDocumentsChain.")
     doc_chain = LLMChain(llm=llm, prompt=scripture_prompt)
     chain = StuffDocumentsChain(
         llm_chain=doc_chain,
@@ -133,21 +149,55 @@ def create_qa_chain(llm: BaseChatModel, retriever: VectorStoreRetriever):
         return_source_documents=True
     )
 
-def create_conversational_chain(llm: BaseChatModel, retriever: VectorStoreRetriever, credentials_json: str):
+def create_conversational_chain(
+    llm: BaseChatModel,
+    retriever: VectorStoreRetriever,
+    credentials_json: str,
+    history_factory: Optional[Callable[[str], BaseChatMessageHistory]] = None
+):
     """
     Creates a conversational chain with message history using Google Sheets.
+
+    The session is taken from config={"configurable": {"session_id": ...}} and its
+    messages are passed to the chain as chat_history. If history_factory is given
+    (e.g. a buffered HistoryStore's get), it is used to look up session histories
+    instead of opening the Google Sheet on every call.
+
+    The chain only reads the history; callers record each turn themselves once the
+    final (merged) answer shown to the user is known.
     """
-    logging.info("Creating conversational chain with message history via Google Sheets.")
+    logger.info("Creating conversational chain with message history via Google Sheets.")
     
     base_qa_chain = create_qa_chain(llm, retriever)
 
-    # Lambda function to pass credentials to get_session_history
-    return RunnableWithMessageHistory(
-        base_qa_chain,
-        lambda session_id: get_session_history(session_id, credentials_json), # Pass credentials
-        input_messages_key="question",
-        history_messages_key="chat_history"
-    )
+    if history_factory is None:
+        # Lambda function to pass credentials to get_session_history
+        history_factory = lambda session_id: get_session_history(session_id, credentials_json) # Pass credentials
+
+    def load_chat_history(inputs: dict, config: RunnableConfig) -> list[BaseMessage]:
+        return history_factory(config["configurable"]["session_id"]).messages
+
+    return RunnablePassthrough.assign(chat_history=RunnableLambda(load_chat_history)) | base_qa_chain
+
+# Merge chains built once per (LLM, table format) and reused across requests
+_merge_chains: Dict[Tuple[int, bool], LLMChain] = {}
+
+def get_merge_chain(llm: BaseChatModel, format_as_table: bool) -> LLMChain:
+    """
+    Returns the merge chain for the given LLM and output format, building it on first use.
+    """
+    key = (id(llm), format_as_table)
+    chain = _merge_chains.get(key)
+    if chain is None or chain.llm is not llm:
+        merge_prompt = merge_prompt_table if format_as_table else merge_prompt_default
+        chain = LLMChain(llm=llm, prompt=merge_prompt)
+        _merge_chains[key] = chain
+        logger.info("Built merge chain (table format: %s).", format_as_table)
+    return chain
+
+def merge_fallback_answer(error: Exception, rag_answer: str) -> str:
+    """Returns the answer shown when merging fails: the error and the unmerged RAG answer."""
+    return f"Error merging answers: {error}. Here is the RAG answer: {rag_answer}"
 
 async def merge_groq_and_rag_answers(
     llm: BaseChatModel,
@@ -157,7 +207,7 @@ async def merge_groq_and_rag_answers(
     life_problem: str,
     scripture_source: str,
     format_as_table: bool = False
-) -> str:
+) -> Tuple[str, bool]:
     """
     Merges the RAG answer with suggestions from Groq models using an LLM.
 
@@ -171,18 +221,17 @@ async def merge_groq_and_rag_answers(
         format_as_table (bool): Whether to format the final output as a markdown table.
 
     Returns:
-        str: The merged and refined answer.
+        Tuple[str, bool]: The merged and refined answer, and whether merging succeeded.
+            On failure the answer is merge_fallback_answer's message instead.
     """
-    logging.info(f"Merging RAG answer and Groq suggestions. Table format requested: {format_as_table}")
+    logger.info("Merging RAG answer and Groq suggestions. Table format requested: %s", format_as_table)
     
     if format_as_table:
-        merge_prompt = merge_prompt_table
-        logging.info("Using table format merge prompt.")
+        logger.info("Using table format merge prompt.")
     else:
-        merge_prompt = merge_prompt_default
-        logging.info("Using default merge prompt.")
+        logger.info("Using default merge prompt.")
 
-    merge_chain = LLMChain(llm=llm, prompt=merge_prompt)
+    merge_chain = get_merge_chain(llm, format_as_table)
 
     try:
         merged_result = await merge_chain.ainvoke({
@@ -194,7 +243,42 @@ async def merge_groq_and_rag_answers(
             "life_problem": life_problem,
             "scripture_source": scripture_source
         })
-        return merged_result['text']
+        return merged_result['text'], True
+    except Exception as e:
+        logger.error("Error during answer merging: %s", e, exc_info=True)
+        return merge_fallback_answer(e, rag_answer), False
+
+async def stream_merged_answer(
+    llm: BaseChatModel,
+    rag_answer: str,
+    groq_suggestions: dict,
+    spiritual_concept: str,
+    life_problem: str,
+    scripture_source: str,
+    format_as_table: bool = False
+) -> AsyncIterator[str]:
+    """
+    Streams the merged answer chunk by chunk as the LLM generates it.
+
+    Takes the same arguments as merge_groq_and_rag_answers. Errors are logged and
+    re-raised, so that callers know the answer is incomplete and can show
+    merge_fallback_answer instead.
+    """
+    logger.info("Streaming merged RAG answer and Groq suggestions. Table format requested: %s", format_as_table)
+    merge_prompt = merge_prompt_table if format_as_table else merge_prompt_default
+
+    try:
+        async for chunk in (merge_prompt | llm).astream({
+            "rag": rag_answer,
+            "llama": groq_suggestions.get("llama", "N/A"),
+            "mixtral": groq_suggestions.get("mixtral", "N/A"),
+            "gemma": groq_suggestions.get("gemma", "N/A"),
+            "spiritual_concept": spiritual_concept,
+            "life_problem": life_problem,
+            "scripture_source": scripture_source
+        }):
+            # Text LLMs stream strings; chat models stream message chunks
+            yield getattr(chunk, "content", chunk)
     except Exception as e:
-        logging.error(f"Error during answer merging: {e}", exc_info=True)
-        return f"Error merging answers: {e}. Here is the RAG answer: {rag_answer}"
+        logger.error("Error during streamed answer merging: %s", e, exc_info=True)
+        raise
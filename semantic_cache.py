@@ -0,0 +1,140 @@
+# semantic_cache.py
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class _CacheEntry:
+    """A single cached answer together with the data needed to verify and evict it."""
+
+    __slots__ = ("vector", "context", "value", "created_at", "bucket_keys")
+
+    def __init__(self, vector: np.ndarray, context: Hashable, value: Any, bucket_keys: List[Tuple]):
+        self.vector = vector
+        self.context = context
+        self.value = value
+        self.created_at = time.monotonic()
+        self.bucket_keys = bucket_keys
+
+class SemanticCache:
+    """
+    Caches answers keyed by query embedding, using random-projection LSH.
+
+    Each of ``num_tables`` hash tables hashes a normalized query vector to the sign
+    pattern of ``num_planes`` random hyperplanes. Entries sharing a bucket with the
+    query in any table are candidates; a candidate is only returned if its cosine
+    similarity to the query is at least ``threshold`` and its context (e.g. the
+    extracted concept/problem/source and table flag) matches exactly.
+    Entries expire after ``ttl_seconds`` and the least recently used entry is
+    evicted once ``max_entries`` is exceeded.
+    """
+
+    def __init__(
+        self,
+        num_planes: int = 16,
+        num_tables: int = 4,
+        threshold: float = 0.95,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        seed: int = 0
+    ):
+        self.num_planes = num_planes
+        self.num_tables = num_tables
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._rng = np.random.default_rng(seed)
+        self._planes: Optional[np.ndarray] = None # Lazily sized on the first vector seen
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        self._tables: List[dict] = [{} for _ in range(num_tables)]
+        self._next_id = 0
+
+    def _normalize(self, vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _bucket_keys(self, vec: np.ndarray, context: Hashable) -> List[Tuple]:
+        """Returns one bucket key per hash table for a normalized vector."""
+        if self._planes is None:
+            self._planes = self._rng.standard_normal(
+                (self.num_tables, self.num_planes, vec.shape[0])
+            ).astype(np.float32)
+        bits = np.sign(self._planes @ vec) > 0 # Shape: (num_tables, num_planes)
+        return [(context, np.packbits(row).tobytes()) for row in bits]
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for table, key in zip(self._tables, entry.bucket_keys):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def _expire(self) -> None:
+        """Drops entries older than the TTL."""
+        now = time.monotonic()
+        expired = [i for i, e in self._entries.items() if now - e.created_at > self.ttl_seconds]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+    def lookup(self, vector, context: Hashable = None) -> Optional[Any]:
+        """
+        Returns the cached value for a semantically similar query, if any.
+
+        Args:
+            vector: The query embedding.
+            context (Hashable): Extra key that must match exactly (e.g. extracted metadata).
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        self._expire()
+        if not self._entries:
+            return None
+        vec = self._normalize(vector)
+        candidates = set()
+        for table, key in zip(self._tables, self._bucket_keys(vec, context)):
+            candidates.update(table.get(key, ()))
+
+        best_id, best_score = None, self.threshold
+        for entry_id in candidates:
+            score = float(np.dot(self._entries[entry_id].vector.astype(np.float32), vec))
+            if score >= best_score:
+                best_id, best_score = entry_id, score
+        if best_id is None:
+            return None
+        self._entries.move_to_end(best_id)
+        logger.info("Semantic cache hit (cosine similarity %.3f).", best_score)
+        return self._entries[best_id].value
+
+    def store(self, vector, value: Any, context: Hashable = None) -> None:
+        """
+        Stores a value under the given query embedding.
+
+        Args:
+            vector: The query embedding.
+            value: The value to cache.
+            context (Hashable): Extra key that must match exactly on lookup.
+        """
+        vec = self._normalize(vector)
+        keys = self._bucket_keys(vec, context)
+        entry_id = self._next_id
+        self._next_id += 1
+        # Stored as float16 to halve cache memory; cosine checks against a 0.95
+        # threshold are unaffected by the ~1e-3 rounding error
+        self._entries[entry_id] = _CacheEntry(vec.astype(np.float16), context, value, keys)
+        for table, key in zip(self._tables, keys):
+            table.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Removes all cached entries."""
+        self._entries.clear()
+        self._tables = [{} for _ in range(self.num_tables)]
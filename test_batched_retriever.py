@@ -0,0 +1,108 @@
+# test_batched_retriever.py
+import asyncio
+import concurrent.futures
+import time
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from batched_retriever import QueryBatcher, BatchedRetriever
+
+class FakeEmbeddings(Embeddings):
+    """Embeds each text as its length, so the search can echo the query back."""
+
+    def embed_documents(self, texts):
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text))]
+
+def fake_search(vectors, k):
+    time.sleep(0.01) # Simulate a blocking vector store call
+    return [[Document(page_content=str(int(vector[0])))] for vector in vectors]
+
+class BatchedRetrieverConcurrencyTest(unittest.TestCase):
+
+    def test_concurrent_sync_invocations_exceeding_default_executor(self):
+        """Chains blocked in every default-executor thread must not starve the batcher."""
+        workers = 5
+        queries = ["q" * n for n in range(1, 4 * workers + 1)]
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=workers))
+            batcher = QueryBatcher(FakeEmbeddings(), fake_search, k=1, max_wait_ms=5)
+            batcher.start()
+            retriever = BatchedRetriever(batcher=batcher, loop=loop, timeout=5)
+            try:
+                return await asyncio.wait_for(
+                    asyncio.gather(*(asyncio.to_thread(retriever.invoke, query) for query in queries)),
+                    timeout=10
+                )
+            finally:
+                await batcher.stop()
+
+        results = asyncio.run(run())
+        self.assertEqual([docs[0].page_content for docs in results], [str(len(q)) for q in queries])
+
+    def test_async_invocations_are_batched(self):
+        batch_sizes = []
+
+        def recording_search(vectors, k):
+            batch_sizes.append(len(vectors))
+            return fake_search(vectors, k)
+
+        async def run():
+            batcher = QueryBatcher(FakeEmbeddings(), recording_search, k=1, max_batch_size=8, max_wait_ms=50)
+            batcher.start()
+            retriever = BatchedRetriever(batcher=batcher, loop=asyncio.get_running_loop())
+            try:
+                return await asyncio.gather(*(retriever.ainvoke("q" * n) for n in range(1, 9)))
+            finally:
+                await batcher.stop()
+
+        results = asyncio.run(run())
+        self.assertEqual([docs[0].page_content for docs in results], [str(n) for n in range(1, 9)])
+        self.assertEqual(batch_sizes, [8])
+
+    def test_remembered_vectors_are_not_embedded_again(self):
+        embedded = []
+        searched = []
+
+        class RecordingEmbeddings(FakeEmbeddings):
+            def embed_documents(self, texts):
+                embedded.extend(texts)
+                return super().embed_documents(texts)
+
+        def recording_search(vectors, k):
+            searched.extend(vectors)
+            return fake_search(vectors, k)
+
+        async def run():
+            batcher = QueryBatcher(RecordingEmbeddings(), recording_search, k=1, max_wait_ms=50)
+            batcher.start()
+            retriever = BatchedRetriever(batcher=batcher, loop=asyncio.get_running_loop())
+            batcher.remember("known", [42.0])
+            try:
+                return await asyncio.gather(retriever.ainvoke("known"), retriever.ainvoke("new"))
+            finally:
+                await batcher.stop()
+
+        results = asyncio.run(run())
+        self.assertEqual([docs[0].page_content for docs in results], ["42", "3"])
+        self.assertEqual(embedded, ["new"])
+        self.assertEqual(searched, [[42.0], [3.0]])
+
+    def test_sync_invocation_times_out(self):
+        async def run():
+            loop = asyncio.get_running_loop()
+            batcher = QueryBatcher(FakeEmbeddings(), fake_search, k=1) # Never started
+            retriever = BatchedRetriever(batcher=batcher, loop=loop, timeout=0.1)
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                await asyncio.to_thread(retriever.invoke, "query")
+
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
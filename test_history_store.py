@@ -0,0 +1,126 @@
+# test_history_store.py
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+import history_store
+from history_store import HistoryStore
+
+class FakeSheetHistory:
+    """Stands in for GoogleSheetChatMessageHistory, keeping each session's rows in memory."""
+
+    sheets = {}
+    lock = threading.Lock()
+    write_delay = 0.0
+
+    def __init__(self, session_id, credentials_json):
+        self.session_id = session_id
+
+    @property
+    def messages(self):
+        with self.lock:
+            return list(self.sheets.get(self.session_id, []))
+
+    def add_messages(self, messages):
+        time.sleep(self.write_delay) # Simulate the Sheets round-trip
+        with self.lock:
+            self.sheets.setdefault(self.session_id, []).extend(messages)
+
+    def clear(self):
+        with self.lock:
+            self.sheets.pop(self.session_id, None)
+
+class HistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        FakeSheetHistory.sheets = {}
+        FakeSheetHistory.write_delay = 0.0
+        patcher = mock.patch.object(history_store, "GoogleSheetChatMessageHistory", FakeSheetHistory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_with_store(self, scenario, **kwargs):
+        async def run():
+            store = HistoryStore("{}", asyncio.get_running_loop(), flush_delay=0.05, **kwargs)
+            return await scenario(store)
+        return asyncio.run(run())
+
+    def test_flush_in_flight_survives_eviction(self):
+        FakeSheetHistory.write_delay = 0.3
+
+        async def scenario(store):
+            history = await asyncio.to_thread(store.get, "a")
+            await asyncio.to_thread(history.add_user_message, "question")
+            await asyncio.to_thread(history.add_ai_message, "answer")
+            await asyncio.sleep(0.15) # The flush is now writing to the sheet
+            await asyncio.to_thread(store.get, "b") # Over max_sessions, so "a" is an eviction candidate
+            await asyncio.to_thread(store.get, "a") # Would reload the sheet without the rows being written
+            await asyncio.sleep(0.4)
+            _, types, contents = await asyncio.to_thread(store.cleaned_view, "a")
+            return types, contents
+
+        types, contents = self.run_with_store(scenario, max_sessions=1)
+        self.assertEqual(len(FakeSheetHistory.sheets["a"]), 2)
+        self.assertEqual(types, ["human", "ai"])
+        self.assertEqual(contents, ["question", "answer"])
+
+    def test_reload_after_eviction_returns_flushed_rows(self):
+        async def scenario(store):
+            history = await asyncio.to_thread(store.get, "a")
+            await asyncio.to_thread(history.add_user_message, "question")
+            await asyncio.to_thread(history.add_ai_message, "answer")
+            await store.flush_all()
+            await asyncio.to_thread(store.get, "b")
+            evicted = "a" not in store._sessions
+            reloaded = await asyncio.to_thread(store.get, "a")
+            return evicted, reloaded is history, reloaded.messages
+
+        evicted, same, messages = self.run_with_store(scenario, max_sessions=1)
+        self.assertTrue(evicted)
+        self.assertFalse(same)
+        self.assertEqual(messages, [HumanMessage(content="question"), AIMessage(content="answer")])
+
+    def test_clear_drops_pending_messages(self):
+        async def scenario(store):
+            history = await asyncio.to_thread(store.get, "a")
+            await asyncio.to_thread(history.add_user_message, "question")
+            await store.clear("a") # Before the debounced flush fires
+            await asyncio.sleep(0.1)
+            return history.messages, dict(store._pending)
+
+        messages, pending = self.run_with_store(scenario)
+        self.assertEqual(messages, [])
+        self.assertEqual(pending, {})
+        self.assertNotIn("a", FakeSheetHistory.sheets)
+
+    def test_version_changes_on_append_and_clear(self):
+        async def scenario(store):
+            history = await asyncio.to_thread(store.get, "a")
+            versions = [store.cleaned_view("a")[0]]
+            await asyncio.to_thread(history.add_user_message, "question")
+            versions.append(store.cleaned_view("a")[0])
+            versions.append(store.cleaned_view("a")[0]) # Unchanged without writes
+            await store.clear("a")
+            versions.append(store.cleaned_view("a")[0])
+            return versions
+
+        loaded, appended, unchanged, cleared = self.run_with_store(scenario)
+        self.assertLess(loaded, appended)
+        self.assertEqual(appended, unchanged)
+        self.assertLess(appended, cleared)
+
+    def test_clearing_unloaded_sessions_does_not_grow_state(self):
+        async def scenario(store):
+            for i in range(50):
+                await store.clear(f"x{i}")
+            return len(store._backends), len(store._flush_locks), len(store._writers)
+
+        backends, flush_locks, writers = self.run_with_store(scenario, max_sessions=2)
+        self.assertEqual((backends, flush_locks, writers), (0, 0, 0))
+
+if __name__ == "__main__":
+    unittest.main()
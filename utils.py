@@ -2,7 +2,12 @@
 import string
 import logging
 import re
-from typing import List
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import ahocorasick
+
+logger = logging.getLogger(__name__)
 
 # Define lists of keywords for categorization and intent detection
 GREETINGS: List[str] = ["hi", "hello", "hey", "namaste", "yo", "pranam", "jai shree ram", "om namah shivaya", "radhe radhe", "good morning", "good afternoon", "good evening"]
@@ -15,10 +20,155 @@ TASK_KEYWORDS: List[str] = [
 ]
 FORMATTING_KEYWORDS: List[str] = ["table", "tabular", "chart", "format", "list", "bullet", "points", "itemize", "enumerate", "in a table", "as a table"]
 
+# Keyword dictionaries mapping each canonical category to the phrases that indicate it
+CONCEPTS: Dict[str, List[str]] = {
+    "dharma": ["dharma", "duty", "righteousness"],
+    "karma": ["karma", "action", "consequence", "karma yoga"],
+    "moksha": ["moksha", "liberation", "salvation", "enlightenment"],
+    "atman": ["atman", "soul", "self"],
+    "brahman": ["brahman", "ultimate reality", "absolute truth"],
+    "yoga": ["yoga", "meditation", "union", "asanas"],
+    "bhakti": ["bhakti", "devotion", "bhakti yoga"],
+    "jnana": ["jnana", "knowledge", "wisdom", "jnana yoga"],
+    "seva": ["seva", "selfless service"],
+    "reincarnation": ["reincarnation", "rebirth", "samsara"],
+    "maya": ["maya", "illusion", "worldly illusion"],
+    "nirvana": ["nirvana", "spiritual liberation"],
+    "guna": ["guna", "qualities", "modes of nature"],
+    "sanskara": ["sanskara", "impressions", "mental imprints"],
+    "sattva": ["sattva", "purity", "goodness"],
+    "rajas": ["rajas", "passion", "activity"],
+    "tamas": ["tamas", "ignorance", "darkness"]
+}
+PROBLEMS: Dict[str, List[str]] = {
+    "stress": ["stress", "tension", "anxiety", "worry", "overwhelmed", "pressure"],
+    "anger": ["anger", "frustration", "irritation", "rage", "resentment"],
+    "grief": ["grief", "loss", "sadness", "sorrow", "bereavement", "heartbreak"],
+    "purpose": ["purpose", "meaning of life", "direction", "aim", "goal", "why am i here", "lack of direction"],
+    "fear": ["fear", "insecurity", "doubt", "apprehension", "courage", "hesitation"],
+    "relationships": ["relationship", "family", "friends", "love", "conflict", "breakup", "marriage", "loneliness", "social issues"],
+    "suffering": ["suffering", "pain", "hardship", "adversity", "misery", "struggle"],
+    "decision making": ["decision", "choice", "dilemma", "confused", "uncertainty", "indecision"],
+    "materialism": ["materialism", "attachment", "desire", "greed"],
+    "ego": ["ego", "pride", "self-importance", "arrogance"],
+    "depression": ["depression", "despair", "hopelessness", "melancholy"]
+}
+SOURCES: Dict[str, List[str]] = {
+    "bhagavad gita": ["bhagavad gita", "gita", "bhagwad geeta"],
+    "veda": ["veda", "vedas", "rigveda", "yajurveda", "samaveda", "atharvaveda"],
+    "upanishad": ["upanishad", "upanishads"],
+    "purana": ["purana", "puranas", "vishnu purana", "bhagavata purana", "garuda purana", "skanda purana"],
+    "ramayana": ["ramayana", "ramayan", "valmiki ramayana"],
+    "mahabharata": ["mahabharata", "mahabharat"],
+    "yoga sutras": ["yoga sutras", "patanjali yoga sutras", "patanjali"],
+    "dharma shastras": ["dharma shastras", "manu smriti"],
+    "hatha yoga pradipika": ["hatha yoga pradipika"],
+    "shiva sutras": ["shiva sutras"],
+    "brahma sutras": ["brahma sutras"],
+    "vedanta": ["vedanta"]
+}
+
+def _build_automaton() -> "ahocorasick.Automaton":
+    """Builds one Aho-Corasick automaton over every keyword used for intent detection."""
+    buckets = {
+        "concept": CONCEPTS,
+        "problem": PROBLEMS,
+        "source": SOURCES,
+        "task": {k: [k] for k in TASK_KEYWORDS},
+        "formatting": {k: [k] for k in FORMATTING_KEYWORDS},
+    }
+    # A phrase may belong to several buckets (e.g. "meditation"), so each value is a list
+    hits_by_phrase: Dict[str, List[Tuple[str, int, str]]] = {}
+    for bucket, categories in buckets.items():
+        for priority, (canonical, phrases) in enumerate(categories.items()):
+            for phrase in phrases:
+                hits_by_phrase.setdefault(phrase, []).append((bucket, priority, canonical))
+    automaton = ahocorasick.Automaton()
+    for phrase, hits in hits_by_phrase.items():
+        automaton.add_word(phrase, tuple(hits))
+    automaton.make_automaton()
+    return automaton
+
+_AUTOMATON = _build_automaton()
+
+# Precompiled patterns and tables used on every request
+_FMT_KW_SET = frozenset(FORMATTING_KEYWORDS)
+_FILLER = frozenset({"in", "a", "as", "give", "me", "show", "it", "that", "please", "can", "you", "provide", "the", "an", "this", "my", "your", "for"})
+_PUNCT_TABLE = str.maketrans('', '', string.punctuation)
+_RE_BULLET = re.compile(r'^\*\*\*([^*])', re.MULTILINE)
+_RE_TRIPLE_NL = re.compile(r'\n\s*\n\s*\n+')
+# Only runs that actually change: a tab, or two or more spaces/tabs (a lone space is left alone)
+_RE_WS = re.compile(r' ?\t[ \t]*| {2,}[ \t]*')
+_RE_LEAD = re.compile(r'^\s+', re.MULTILINE)
+_RE_STARSPACE = re.compile(r'\*\*\s*\*\*')
+_RE_STARFIX = re.compile(r'\*\*([^*]+)\*\*\*')
+_RE_SENT = re.compile(r'\.([A-Z])')
+
 
 def _clean_query(query: str) -> str:
     """Helper function to clean and normalize a query string."""
-    return query.translate(str.maketrans('', '', string.punctuation)).strip().lower()
+    return query.translate(_PUNCT_TABLE).strip().lower()
+
+def _scan(text: str) -> Dict[str, str]:
+    """
+    Scans already-lowercased text for every known keyword in a single pass.
+
+    Returns a mapping from keyword bucket to the canonical name of the matched
+    category. When several categories of a bucket match, the one listed first
+    in its keyword dictionary wins, as with the previous sequential scans.
+    """
+    best: Dict[str, Tuple[int, str]] = {}
+    for _, hits in _AUTOMATON.iter(text):
+        for bucket, priority, canonical in hits:
+            if bucket not in best or priority < best[bucket][0]:
+                best[bucket] = (priority, canonical)
+    return {bucket: canonical for bucket, (_, canonical) in best.items()}
+
+def _is_greeting(cleaned_query: str, hits: Dict[str, str]) -> bool:
+    words = cleaned_query.split()
+    # Check if it's a known greeting and not too long, and doesn't contain task keywords
+    is_pure_greeting = cleaned_query in GREETINGS and len(words) <= 3
+    contains_task_keywords = "task" in hits
+    return is_pure_greeting and not contains_task_keywords
+
+def _is_formatting_request(cleaned_query: str, hits: Dict[str, str]) -> bool:
+    # Must contain at least one formatting keyword
+    if "formatting" not in hits:
+        return False
+
+    # Remove common filler words and formatting keywords to see if any substantive words remain
+    non_formatting_or_filler_words = [
+        w for w in cleaned_query.split() if w not in _FMT_KW_SET and w not in _FILLER
+    ]
+
+    # If there are very few substantive words left (e.g., 0 or 1), it's likely a formatting request
+    return len(non_formatting_or_filler_words) <= 1
+
+def _spiritual_concept(hits: Dict[str, str]) -> str:
+    concept = hits.get("concept")
+    if concept:
+        logger.info("Detected spiritual concept: %s", concept)
+        return concept
+    logger.info("No specific spiritual concept detected, defaulting to 'general'.")
+    return "general"
+
+def _life_problem(hits: Dict[str, str]) -> str:
+    problem = hits.get("problem")
+    if problem:
+        logger.info("Detected life problem: %s", problem)
+        return problem
+    logger.info("No specific life problem detected, defaulting to 'guidance'.")
+    return "guidance"
+
+def _scripture_source(hits: Dict[str, str]) -> str:
+    source = hits.get("source")
+    if source:
+        formatted_source = " ".join([w.capitalize() for w in source.split()])
+        logger.info("Detected scripture source: %s", formatted_source)
+        return formatted_source
+    logger.info("No specific scripture source detected, defaulting to 'Hindu scriptures'.")
+    return "Hindu scriptures"
+
 
 def is_greeting(query: str) -> bool:
     """
@@ -30,11 +180,7 @@ def is_greeting(query: str) -> bool:
     if not query:
         return False
     cleaned_query = _clean_query(query)
-    words = cleaned_query.split()
-    # Check if it's a known greeting and not too long, and doesn't contain task keywords
-    is_pure_greeting = cleaned_query in GREETINGS and len(words) <= 3
-    contains_task_keywords = any(k in cleaned_query for k in TASK_KEYWORDS)
-    return is_pure_greeting and not contains_task_keywords
+    return _is_greeting(cleaned_query, _scan(cleaned_query))
 
 
 def is_formatting_request(query: str) -> bool:
@@ -47,20 +193,7 @@ def is_formatting_request(query: str) -> bool:
     if not query:
         return False
     cleaned_query = _clean_query(query)
-    words = cleaned_query.split()
-
-    # Must contain at least one formatting keyword
-    if not any(keyword in cleaned_query for keyword in FORMATTING_KEYWORDS):
-        return False
-
-    # Remove common filler words and formatting keywords to see if any substantive words remain
-    filler_words = ["in", "a", "as", "give", "me", "show", "it", "that", "please", "can", "you", "provide", "the", "an", "this", "my", "your", "for", "me"]
-    non_formatting_or_filler_words = [
-        w for w in words if w not in FORMATTING_KEYWORDS and w not in filler_words
-    ]
-
-    # If there are very few substantive words left (e.g., 0 or 1), it's likely a formatting request
-    return len(non_formatting_or_filler_words) <= 1
+    return _is_formatting_request(cleaned_query, _scan(cleaned_query))
 
 
 def extract_spiritual_concept(query: str) -> str:
@@ -68,32 +201,7 @@ def extract_spiritual_concept(query: str) -> str:
     Extracts a spiritual concept from the query if mentioned.
     Returns "general" if no specific concept is identified.
     """
-    q = query.lower()
-    concepts = {
-        "dharma": ["dharma", "duty", "righteousness"],
-        "karma": ["karma", "action", "consequence", "karma yoga"],
-        "moksha": ["moksha", "liberation", "salvation", "enlightenment"],
-        "atman": ["atman", "soul", "self"],
-        "brahman": ["brahman", "ultimate reality", "absolute truth"],
-        "yoga": ["yoga", "meditation", "union", "asanas"],
-        "bhakti": ["bhakti", "devotion", "bhakti yoga"],
-        "jnana": ["jnana", "knowledge", "wisdom", "jnana yoga"],
-        "seva": ["seva", "selfless service"],
-        "reincarnation": ["reincarnation", "rebirth", "samsara"],
-        "maya": ["maya", "illusion", "worldly illusion"],
-        "nirvana": ["nirvana", "spiritual liberation"],
-        "guna": ["guna", "qualities", "modes of nature"],
-        "sanskara": ["sanskara", "impressions", "mental imprints"],
-        "sattva": ["sattva", "purity", "goodness"],
-        "rajas": ["rajas", "passion", "activity"],
-        "tamas": ["tamas", "ignorance", "darkness"]
-    }
-    for concept, kws in concepts.items():
-        if any(k in q for k in kws):
-            logging.info(f"Detected spiritual concept: {concept}")
-            return concept
-    logging.info("No specific spiritual concept detected, defaulting to 'general'.")
-    return "general"
+    return _spiritual_concept(_scan(query.lower()))
 
 
 def extract_life_problem(query: str) -> str:
@@ -101,26 +209,7 @@ def extract_life_problem(query: str) -> str:
     Extracts a common life problem from the query if mentioned.
     Returns "guidance" if no specific problem is identified.
     """
-    q = query.lower()
-    problems = {
-        "stress": ["stress", "tension", "anxiety", "worry", "overwhelmed", "pressure"],
-        "anger": ["anger", "frustration", "irritation", "rage", "resentment"],
-        "grief": ["grief", "loss", "sadness", "sorrow", "bereavement", "heartbreak"],
-        "purpose": ["purpose", "meaning of life", "direction", "aim", "goal", "why am i here", "lack of direction"],
-        "fear": ["fear", "insecurity", "doubt", "apprehension", "courage", "hesitation"],
-        "relationships": ["relationship", "family", "friends", "love", "conflict", "breakup", "marriage", "loneliness", "social issues"],
-        "suffering": ["suffering", "pain", "hardship", "adversity", "misery", "struggle"],
-        "decision making": ["decision", "choice", "dilemma", "confused", "uncertainty", "indecision"],
-        "materialism": ["materialism", "attachment", "desire", "greed"],
-        "ego": ["ego", "pride", "self-importance", "arrogance"],
-        "depression": ["depression", "despair", "hopelessness", "melancholy"]
-    }
-    for problem, kws in problems.items():
-        if any(k in q for k in kws):
-            logging.info(f"Detected life problem: {problem}")
-            return problem
-    logging.info("No specific life problem detected, defaulting to 'guidance'.")
-    return "guidance"
+    return _life_problem(_scan(query.lower()))
 
 
 def extract_scripture_source(query: str) -> str:
@@ -128,36 +217,49 @@ def extract_scripture_source(query: str) -> str:
     Extracts a specific Hindu scripture source from the query if mentioned.
     Returns "Hindu scriptures" if no specific source is identified.
     """
-    q = query.lower()
-    sources = {
-        "bhagavad gita": ["bhagavad gita", "gita", "bhagwad geeta"],
-        "veda": ["veda", "vedas", "rigveda", "yajurveda", "samaveda", "atharvaveda"],
-        "upanishad": ["upanishad", "upanishads"],
-        "purana": ["purana", "puranas", "vishnu purana", "bhagavata purana", "garuda purana", "skanda purana"],
-        "ramayana": ["ramayana", "ramayan", "valmiki ramayana"],
-        "mahabharata": ["mahabharata", "mahabharat"],
-        "yoga sutras": ["yoga sutras", "patanjali yoga sutras", "patanjali"],
-        "dharma shastras": ["dharma shastras", "manu smriti"],
-        "hatha yoga pradipika": ["hatha yoga pradipika"],
-        "shiva sutras": ["shiva sutras"],
-        "brahma sutras": ["brahma sutras"],
-        "vedanta": ["vedanta"]
-    }
-    for source, kws in sources.items():
-        if any(k in q for k in kws):
-            formatted_source = " ".join([w.capitalize() for w in source.split()])
-            logging.info(f"Detected scripture source: {formatted_source}")
-            return formatted_source
-    logging.info("No specific scripture source detected, defaulting to 'Hindu scriptures'.")
-    return "Hindu scriptures"
+    return _scripture_source(_scan(query.lower()))
 
 
 def contains_table_request(query: str) -> bool:
     """
     Checks if the user's query explicitly asks for a table format.
     """
-    q = query.lower()
-    return any(k in q for k in FORMATTING_KEYWORDS)
+    return "formatting" in _scan(query.lower())
+
+
+@dataclass
+class QueryFeatures:
+    """Everything the chat flow needs to know about a query, computed in one go."""
+    q_lower: str
+    spiritual_concept: str
+    life_problem: str
+    scripture_source: str
+    format_as_table: bool
+    is_greeting: bool
+    is_formatting_request: bool
+
+
+def extract_features(query: str) -> QueryFeatures:
+    """
+    Lowercases and scans the query once and derives all intent and metadata features.
+
+    Equivalent to calling the individual helpers above on the same query.
+    """
+    q_lower = query.lower()
+    hits = _scan(q_lower)
+    # Greeting and formatting checks work on the punctuation-stripped query;
+    # only rescan when stripping actually changed it
+    cleaned_query = _clean_query(query)
+    cleaned_hits = hits if cleaned_query == q_lower else _scan(cleaned_query)
+    return QueryFeatures(
+        q_lower=q_lower,
+        spiritual_concept=_spiritual_concept(hits),
+        life_problem=_life_problem(hits),
+        scripture_source=_scripture_source(hits),
+        format_as_table="formatting" in hits,
+        is_greeting=bool(query) and _is_greeting(cleaned_query, cleaned_hits),
+        is_formatting_request=bool(query) and _is_formatting_request(cleaned_query, cleaned_hits)
+    )
 
 
 def clean_response_text(text: str) -> str:
@@ -166,30 +268,74 @@ def clean_response_text(text: str) -> str:
         return text
     
     # Fix triple asterisks and other markdown formatting issues
-    text = text.replace('***', '**')
-    text = text.replace('****', '**')
-    text = text.replace('*****', '**')
-    
-    # Fix broken bullet points that might appear as ***
-    text = re.sub(r'^\*\*\*([^*])', r'• \1', text, flags=re.MULTILINE)
+    if '***' in text:
+        text = text.replace('***', '**')
+        text = text.replace('****', '**')
+        text = text.replace('*****', '**')
+
+        # Fix broken bullet points that might appear as ***
+        if '***' in text:
+            text = _RE_BULLET.sub(r'• \1', text)
     
     # Clean up excessive whitespace
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)  # Multiple line breaks to double
-    text = re.sub(r'[ \t]+', ' ', text)  # Multiple spaces/tabs to single space
-    text = re.sub(r'^\s+', '', text, flags=re.MULTILINE)  # Leading whitespace on lines
+    text = _RE_TRIPLE_NL.sub('\n\n', text)  # Multiple line breaks to double
+    text = _RE_WS.sub(' ', text)  # Multiple spaces/tabs to single space
+    text = _RE_LEAD.sub('', text)  # Leading whitespace on lines
     
     # Fix common formatting issues
-    text = re.sub(r'\*\*\s*\*\*', '**', text)  # ** ** to **
-    text = re.sub(r'\*\*([^*]+)\*\*\*', r'**\1**', text)  # **text*** to **text**
+    if '**' in text:
+        text = _RE_STARSPACE.sub('**', text)  # ** ** to **
+        if '***' in text:
+            text = _RE_STARFIX.sub(r'**\1**', text)  # **text*** to **text**
     
     # Ensure proper sentence spacing
-    text = re.sub(r'\.([A-Z])', r'. \1', text)
+    text = _RE_SENT.sub(r'. \1', text)
     
     return text.strip()
 
-def clean_suggestions(suggestions: dict) -> dict:
+class IncrementalCleaner:
+    """
+    Applies clean_response_text to streamed text, emitting only what can no longer change.
+
+    The last word of the text seen so far is held back, since later chunks can still
+    alter it (e.g. by completing a run of asterisks or a sentence boundary).
+    """
+
+    def __init__(self) -> None:
+        self._raw = ""
+        self._emitted = ""
+
+    def feed(self, chunk: str) -> str:
+        """Adds a chunk of raw text and returns the newly stable cleaned text, if any."""
+        self._raw += chunk
+        cleaned = clean_response_text(self._raw)
+        cut = len(cleaned)
+        while cut and not cleaned[cut - 1].isspace():
+            cut -= 1
+        stable = cleaned[:cut].rstrip()
+        if len(stable) <= len(self._emitted) or not stable.startswith(self._emitted):
+            return ""
+        delta = stable[len(self._emitted):]
+        self._emitted = stable
+        return delta
+
+    def finish(self) -> str:
+        """Returns the rest of the cleaned text once the stream has ended."""
+        cleaned = self.text
+        if not cleaned.startswith(self._emitted):
+            return ""
+        delta = cleaned[len(self._emitted):]
+        self._emitted = cleaned
+        return delta
+
+    @property
+    def text(self) -> str:
+        """The full cleaned text of everything fed so far."""
+        return clean_response_text(self._raw)
+
+def clean_suggestions(suggestions: Dict[str, Any]) -> Dict[str, Any]:
     """Clean up all suggestion texts"""
-    cleaned = {}
+    cleaned: Dict[str, Any] = {}
     for key, value in suggestions.items():
         if isinstance(value, str):
             cleaned[key] = clean_response_text(value)
@@ -2,6 +2,8 @@
 from langchain_community.vectorstores import Chroma
 # Changed import from HuggingFaceEmbeddings to BaseEmbeddings as it's more generic
 from langchain_core.embeddings import Embeddings # Use the generic Embeddings type
+from langchain_core.documents import Document
+from typing import List
 import os
 import logging
 
@@ -36,3 +38,15 @@ def load_chroma_db(embedding: Embeddings, directory: str = "db"): # Changed type
     except Exception as e:
         logging.error(f"Error loading ChromaDB from '{directory}': {e}")
         raise
+
+def chroma_batch_search(db: Chroma, vectors: List[List[float]], k: int) -> List[List[Document]]:
+    """Returns the top k documents for each query vector using one Chroma query call."""
+    results = db._collection.query(
+        query_embeddings=vectors,
+        n_results=k,
+        include=["documents", "metadatas"]
+    )
+    return [
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(results["documents"], results["metadatas"])
+    ]
@@ -0,0 +1,113 @@
+# vector_db_faiss.py
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS, Chroma
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from typing import List
+import faiss
+import numpy as np
+import os
+import logging
+
+# Scalar quantizers available for the stored vectors: 1 byte or 2 bytes per dimension
+QUANTIZERS = {
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+}
+
+def build_faiss_from_chroma(
+    chroma_db: Chroma,
+    embedding: Embeddings,
+    directory: str = "faiss_db",
+    hnsw_m: int = 32,
+    quantizer: str = "int8"
+) -> FAISS:
+    """
+    Copies the vectors of an existing ChromaDB store into a quantized FAISS HNSW index.
+
+    The stored embeddings are reused as-is (no re-embedding), L2-normalized so that
+    inner product equals cosine similarity, and scalar-quantized to 8 bits ("int8")
+    or 16 bits ("fp16") per dimension, a quarter or half of Chroma's float32 storage.
+    Query vectors need no normalization for ranking, since their norm is constant per query.
+
+    Args:
+        chroma_db (Chroma): The loaded ChromaDB vector store to migrate.
+        embedding (Embeddings): The embedding function used to create the store.
+        directory (str): Where to persist the FAISS index and docstore.
+        hnsw_m (int): Number of neighbours per node in the HNSW graph.
+        quantizer (str): "int8" or "fp16"; see QUANTIZERS.
+
+    Returns:
+        FAISS: The persisted FAISS vector store.
+    """
+    data = chroma_db._collection.get(include=["embeddings", "documents", "metadatas"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if vectors.size == 0:
+        raise ValueError("ChromaDB collection is empty; nothing to migrate.")
+    faiss.normalize_L2(vectors)
+
+    if quantizer not in QUANTIZERS:
+        raise ValueError(f"Unknown quantizer '{quantizer}'. Expected one of: {', '.join(QUANTIZERS)}.")
+    index = faiss.IndexHNSWSQ(vectors.shape[1], QUANTIZERS[quantizer], hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.train(vectors) # Learns the per-dimension ranges used for int8 quantization (no-op for fp16)
+    index.add(vectors)
+
+    docstore = InMemoryDocstore({
+        str(i): Document(page_content=text, metadata=metadata or {})
+        for i, (text, metadata) in enumerate(zip(data["documents"], data["metadatas"]))
+    })
+    db = FAISS(
+        embedding,
+        index,
+        docstore,
+        {i: str(i) for i in range(len(vectors))},
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+    )
+    db.save_local(directory)
+    logging.info(f"Migrated {len(vectors)} vectors from ChromaDB into {quantizer} FAISS index at '{directory}'.")
+    return db
+
+def load_faiss_db(embedding: Embeddings, directory: str = "faiss_db") -> FAISS:
+    """
+    Loads a FAISS vector store created by build_faiss_from_chroma.
+
+    Args:
+        embedding (Embeddings): The embedding function used to create the vector store.
+        directory (str): The path to the directory where the FAISS index is persisted.
+
+    Returns:
+        FAISS: An instance of the loaded FAISS vector store.
+
+    Raises:
+        FileNotFoundError: If the specified FAISS directory does not exist.
+        Exception: For other errors during loading.
+    """
+    if not os.path.exists(directory):
+        logging.error(f"FAISS directory '{directory}' not found. "
+                      "Run migrate_to_faiss.py to build it from the ChromaDB store.")
+        raise FileNotFoundError(f"FAISS directory '{directory}' not found. "
+                                "Please build the index before using the FAISS backend.")
+    try:
+        # The index and docstore were written by this app, so unpickling them is safe
+        db = FAISS.load_local(
+            directory,
+            embedding,
+            allow_dangerous_deserialization=True,
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        logging.info(f"Successfully loaded FAISS index from '{directory}' ({db.index.ntotal} vectors).")
+        return db
+    except Exception as e:
+        logging.error(f"Error loading FAISS index from '{directory}': {e}")
+        raise
+
+def faiss_batch_search(db: FAISS, vectors: List[List[float]], k: int) -> List[List[Document]]:
+    """Returns the top k documents for each query vector using one FAISS search call."""
+    queries = np.asarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    _, ids = db.index.search(queries, k)
+    return [
+        [db.docstore.search(db.index_to_docstore_id[i]) for i in row if i != -1]
+        for row in ids
+    ]